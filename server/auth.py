@@ -1,28 +1,58 @@
 # auth.py
 import os
+import time
+import asyncio
+import hashlib
+import secrets
+import threading
 import logging  # Import logging module
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import jwt, JWTError
+import jwt
+from jwt import InvalidTokenError
 from pydantic import BaseModel
-from passlib.context import CryptContext
-from sqlalchemy import Column, String, DateTime
-from sqlalchemy.orm import Session, declarative_base
+from argon2 import PasswordHasher, Type as Argon2Type
+from argon2.exceptions import VerificationError, InvalidHashError
+from cachetools import TTLCache
+from sqlalchemy import Column, String, ForeignKey, select, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db, engine, Base 
+from database import get_db, Base, UTCDateTime
 
 # -----------------------
 # Config
 # -----------------------
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = "HS256"
+_ALGORITHMS = [ALGORITHM]
+_SIGNING_KEY = SECRET_KEY.encode()  # bytes once, not per encode/decode
 ACCESS_TOKEN_EXPIRE_MINUTES = 600  # 10 hours (instead of 30 minutes)
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+# Live refresh tokens kept per user; the oldest are dropped as new ones are issued
+MAX_REFRESH_TOKENS_PER_USER = int(os.getenv("MAX_REFRESH_TOKENS_PER_USER", "5"))
 
-# Password hashing - Updated to use Argon2
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Password hashing - argon2-cffi directly (OWASP argon2id profile: 46 MiB, t=3, p=1)
+pwd_hasher = PasswordHasher(
+    time_cost=3,
+    memory_cost=46 * 1024,
+    parallelism=1,
+    type=Argon2Type.ID,
+)
+
+# Argon2 runs on its own bounded pool so hashing bursts can't exhaust the shared
+# threadpool used for other blocking work (each hash holds 46 MiB)
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 4)))
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="argon2")
+
+# Authenticated-token cache: skips jwt.decode + user lookup on repeat requests
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
@@ -39,9 +69,14 @@ class User(Base):
     username = Column(String, primary_key=True, index=True)
     hashed_password = Column(String, nullable=False)
     user_type = Column(String, default="user")  # 'admin' or 'user'
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
 
-Base.metadata.create_all(bind=engine)
+# Opaque refresh tokens - only the SHA-256 of the token is stored
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    token_hash = Column(String, primary_key=True)
+    username = Column(String, ForeignKey("users.username", ondelete="CASCADE"), nullable=False, index=True)
+    expires_at = Column(UTCDateTime, nullable=False)
 
 # -----------------------
 # Pydantic Schemas
@@ -49,6 +84,10 @@ Base.metadata.create_all(bind=engine)
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+
+class RefreshIn(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     username: Optional[str] = None
@@ -58,14 +97,59 @@ class UserIn(BaseModel):
     password: str
     user_type: Optional[str] = "user"  # Add this line
 
+# -----------------------
+# Token cache
+# -----------------------
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+_token_cache_lock = threading.Lock()
+
+def _token_cache_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def _cache_get_user(token: str) -> Optional[User]:
+    with _token_cache_lock:
+        entry = _token_cache.get(_token_cache_key(token))
+    # Never serve a cached user past the token's own expiry
+    if entry is None or entry["exp"] <= time.time():
+        return None
+    # Detached instance built from plain fields; not bound to any session
+    return User(username=entry["username"], user_type=entry["user_type"], created_at=entry["created_at"])
+
+def _cache_put_user(token: str, exp: float, user: User) -> None:
+    entry = {
+        "exp": exp,
+        "username": user.username,
+        "user_type": user.user_type,
+        "created_at": user.created_at,
+    }
+    with _token_cache_lock:
+        _token_cache[_token_cache_key(token)] = entry
+
 # -----------------------
 # Hashing and JWT Utils
 # -----------------------
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return pwd_hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return pwd_hasher.hash(password)
+
+# Verified against when the username doesn't exist, so unknown and known users cost
+# the same Argon2 work (no enumeration timing oracle, no bimodal login latency)
+_DUMMY_HASH = get_password_hash("dummy-password-for-timing")
+
+def password_needs_rehash(hashed_password):
+    # Older passlib-generated hashes are plain argon2 PHC strings, so they verify
+    # fine but may carry weaker parameters than the current profile
+    return pwd_hasher.check_needs_rehash(hashed_password)
+
+async def run_hashing(fn, *args):
+    """Run an Argon2 hash/verify on the dedicated hashing pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, fn, *args)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -74,33 +158,72 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _SIGNING_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def _refresh_token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+async def issue_refresh_token(db: AsyncSession, username: str) -> str:
+    """Store a new opaque refresh token for the user; the caller commits.
+
+    Expired tokens and all but the newest MAX_REFRESH_TOKENS_PER_USER - 1 live ones
+    are pruned in the same transaction, so logins don't grow the table unbounded.
+    """
+    now = datetime.now(timezone.utc)
+    keep = (
+        select(RefreshToken.token_hash)
+        .where(RefreshToken.username == username, RefreshToken.expires_at > now)
+        .order_by(RefreshToken.expires_at.desc())
+        .limit(max(MAX_REFRESH_TOKENS_PER_USER - 1, 0))
+    )
+    await db.execute(
+        delete(RefreshToken)
+        .where(RefreshToken.username == username, RefreshToken.token_hash.not_in(keep))
+    )
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        token_hash=_refresh_token_hash(token),
+        username=username,
+        expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return token
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached_user = _cache_get_user(token)
+    if cached_user is not None:
+        return cached_user
+
     try:
-        logger.info("Decoding token...")
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        logger.info(f"Token payload: {payload}")
+        # Decode off the event loop so concurrent requests aren't serialized behind it
+        payload = await run_in_threadpool(jwt.decode, token, _SIGNING_KEY, algorithms=_ALGORITHMS)
         username: str = payload.get("sub")
         if username is None:
             logger.error("Token payload missing 'sub' field.")
             raise credentials_exception
         token_data = TokenData(username=username)
-    except JWTError as e:
-        logger.error(f"JWT decoding error: {e}")
+        exp = payload.get("exp")
+    except InvalidTokenError as e:
+        logger.error("JWT decoding error: %s", e)
         raise credentials_exception
     
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
-        logger.error(f"User not found for username: {token_data.username}")
+    # Only the columns callers read; no ORM hydration or identity-map tracking
+    row = (await db.execute(
+        select(User.username, User.user_type, User.created_at)
+        .where(User.username == token_data.username)
+    )).first()
+    if row is None:
+        logger.error("User not found for username: %s", token_data.username)
         raise credentials_exception
-    logger.info(f"Authenticated user: {user.username}")
+    user = User(username=row.username, user_type=row.user_type, created_at=row.created_at)
+    if exp is not None:
+        _cache_put_user(token, exp, user)
+    logger.debug("Authenticated user: %s", user.username)
     return user
 
 # -----------------------
@@ -112,39 +235,96 @@ router = APIRouter(
 )
 
 @router.post("/register")
-def register_user(body: UserIn, db: Session = Depends(get_db)):
-    existing_user = db.query(User).filter(User.username == body.username).first()
-    if existing_user:
-        logger.warning(f"Attempt to register already existing username: {body.username}")
+async def register_user(body: UserIn, db: AsyncSession = Depends(get_db)):
+    # Argon2 is CPU/memory heavy; hash off the event loop on the hashing pool
+    hashed_password = await run_hashing(get_password_hash, body.password)
+
+    # Single round trip: the unique username index decides whether we inserted,
+    # which also closes the race between an existence check and the insert
+    # Use the user_type from the request, default to "user" if not provided
+    stmt = (
+        pg_insert(User)
+        .values(username=body.username, hashed_password=hashed_password, user_type=body.user_type or "user")
+        .on_conflict_do_nothing(index_elements=[User.username])
+        .returning(User.username)
+    )
+    created = (await db.execute(stmt)).first()
+    if created is None:
+        await db.rollback()
+        logger.warning("Attempt to register already existing username: %s", body.username)
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Username already registered"
         )
-    
-    hashed_password = get_password_hash(body.password)
-    # Use the user_type from the request, default to "user" if not provided
-    new_user = User(username=body.username, hashed_password=hashed_password, user_type=body.user_type or "user")
-    
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    logger.info(f"User registered successfully: {new_user.username}")
+
+    await db.commit()
+    logger.info("User registered successfully: %s", created.username)
     return {"message": "User registered successfully"}
 
 @router.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
-        logger.warning(f"Failed login attempt for username: {form_data.username}")
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = (await db.execute(
+        select(User.username, User.hashed_password, User.user_type)
+        .where(User.username == form_data.username)
+    )).first()
+    # Argon2 releases the GIL, so concurrent logins verify in parallel on worker threads
+    target_hash = user.hashed_password if user else _DUMMY_HASH
+    password_ok = await run_hashing(verify_password, form_data.password, target_hash)
+    if not user or not password_ok:
+        logger.warning("Failed login attempt for username: %s", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # Transparently upgrade legacy hashes now that we have the plaintext
+    if password_needs_rehash(user.hashed_password):
+        new_hash = await run_hashing(get_password_hash, form_data.password)
+        await db.execute(update(User).where(User.username == user.username).values(hashed_password=new_hash))
+        await db.commit()
+        logger.info("Password hash upgraded for user: %s", user.username)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username, "user_type": user.user_type}, expires_delta=access_token_expires
     )
-    logger.info(f"Access token created for user: {user.username}")
-    return {"access_token": access_token}
\ No newline at end of file
+    refresh_token = await issue_refresh_token(db, user.username)
+    await db.commit()
+    logger.info("Access token created for user: %s", user.username)
+    return {"access_token": access_token, "refresh_token": refresh_token}
+
+@router.post("/refresh", response_model=Token)
+async def refresh_access_token(body: RefreshIn, db: AsyncSession = Depends(get_db)):
+    """Exchange a refresh token for a new access token - an index lookup, no Argon2."""
+    # Deleting with RETURNING consumes the token atomically, so it can't be replayed
+    consumed = (await db.execute(
+        delete(RefreshToken)
+        .where(
+            RefreshToken.token_hash == _refresh_token_hash(body.refresh_token),
+            RefreshToken.expires_at > datetime.now(timezone.utc),
+        )
+        .returning(RefreshToken.username)
+    )).first()
+    user = None
+    if consumed is not None:
+        user = (await db.execute(
+            select(User.username, User.user_type).where(User.username == consumed.username)
+        )).first()
+    if user is None:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    access_token = create_access_token(
+        data={"sub": user.username, "user_type": user.user_type},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    # Rotate: every use hands out a fresh refresh token
+    refresh_token = await issue_refresh_token(db, user.username)
+    await db.commit()
+    logger.info("Access token refreshed for user: %s", user.username)
+    return {"access_token": access_token, "refresh_token": refresh_token}
\ No newline at end of file
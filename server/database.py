@@ -1,6 +1,9 @@
 # database.py
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from datetime import timezone
+from sqlalchemy import DateTime, TypeDecorator
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base
 import os
 from dotenv import load_dotenv
 
@@ -8,28 +11,51 @@ load_dotenv()
 
 # Config
 DB_URL = os.getenv("VC_DB_URL")
+# VC_DB_URL stays a plain postgresql:// URL; the async engine always talks asyncpg
+ASYNC_DB_URL = make_url(DB_URL).set(drivername="postgresql+asyncpg")
 POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
 MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
 POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Seconds to wait for a free connection before failing fast instead of queueing
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1500"))
 
 # Database setup
-engine = create_engine(
-    DB_URL,
+engine = create_async_engine(
+    ASYNC_DB_URL,
     pool_pre_ping=True,
     pool_size=POOL_SIZE,
     max_overflow=MAX_OVERFLOW,
     pool_recycle=POOL_RECYCLE,
-    future=True,
+    pool_timeout=POOL_TIMEOUT,
+    pool_use_lifo=True,  # reuse the most recently returned (warm) connection
+    query_cache_size=QUERY_CACHE_SIZE,
     echo=False
 )
 
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+# expire_on_commit=False: attributes stay readable after commit without an implicit (sync) reload
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+class UTCDateTime(TypeDecorator):
+    """Naive-UTC `timestamp` column that also accepts timezone-aware datetimes.
+
+    asyncpg refuses aware datetimes for `timestamp without time zone`, so they are
+    normalized to UTC and stripped of tzinfo on the way in.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
 # Dependency for database sessions
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
\ No newline at end of file
@@ -4,64 +4,67 @@
 from __future__ import annotations
 
 import os
+import time
+import logging
 import json
+import base64
 import hashlib
+import orjson
 import enum
+import threading
 from datetime import datetime, timezone
 from typing import Any, List, Optional, Dict
 from contextlib import asynccontextmanager  # Add this import
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 
 from sqlalchemy import (
-    create_engine, Column, String, DateTime, Enum as SAEnum, Text,
-    Boolean, ForeignKey, Integer, UniqueConstraint
+    Column, String, Enum as SAEnum, Text,
+    Boolean, ForeignKey, Integer, UniqueConstraint, Index, insert, update, text, func,
+    any_, bindparam, cast, exists, literal
 )
-from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import declarative_base, sessionmaker, Session, relationship, selectinload  # Add selectinload here
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, UUID, insert as pg_insert, aggregate_order_by
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import relationship
 from sqlalchemy.future import select
 
-from jose import jwt 
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import uuid
 from dotenv import load_dotenv
+from cachetools import TTLCache
 
-from database import Base, engine, get_db 
+from database import Base, SessionLocal, get_db, UTCDateTime, create_tables
 from auth import router as auth_router, get_current_user, User, get_password_hash
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # -----------------------
 # Config / Secrets
 # -----------------------
-# Example: postgresql://<user>:<pass>@<host>:<port>/<db>
-DB_URL = os.getenv("VC_DB_URL")
-
 FERNET_KEY = os.getenv("VC_STORE_KEY")
 fernet = Fernet(FERNET_KEY.encode() if isinstance(FERNET_KEY, str) else FERNET_KEY)
 
-# Connection pool tuning (override via env if needed)
-POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
-MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
-POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# New blobs are sealed with AES-256-GCM (single-pass AES-NI/CLMUL) under a key derived
+# from VC_STORE_KEY; Fernet is kept only to read blobs written before the switch.
+AESGCM_PREFIX = "v2:"
+aesgcm = AESGCM(HKDF(
+    algorithm=hashes.SHA256(), length=32, salt=None, info=b"vc-store aes-256-gcm",
+).derive(base64.urlsafe_b64decode(FERNET_KEY)))
 
-# -----------------------
-# Database setup (Postgres)
-# -----------------------
-engine = create_engine(
-    DB_URL,
-    pool_pre_ping=True,
-    pool_size=POOL_SIZE,
-    max_overflow=MAX_OVERFLOW,
-    pool_recycle=POOL_RECYCLE,
-    future=True,
-    echo=False
-)
+# Seconds a feed body is served without even re-running its version probe
+FEED_CACHE_TTL = float(os.getenv("FEED_CACHE_TTL", "5"))
 
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
-Base = declarative_base()
+# Rows per multi-VALUES INSERT in batch uploads (keeps bind params under Postgres' 32767 cap)
+BATCH_INSERT_CHUNK = 1000
 
 # -----------------------
 # Models
@@ -71,29 +74,29 @@ class VCFormat(str, enum.Enum):
 
 class Holder(Base):
     __tablename__ = "holders"
-    id = Column(String, primary_key=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     subject = Column(String, unique=True, index=True)
     display_name = Column(String, nullable=True)
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
 
 class Issuer(Base):
     __tablename__ = "issuers"
-    id = Column(String, primary_key=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     issuer_id = Column(String, unique=True, index=True)
     name = Column(String, nullable=True)
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
-    keys = relationship("IssuerKey", back_populates="issuer", cascade="all, delete-orphan", lazy="selectin")
+    created_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
+    keys = relationship("IssuerKey", back_populates="issuer", cascade="all, delete-orphan")
 
 class IssuerKey(Base):
     __tablename__ = "issuer_keys"
-    id = Column(String, primary_key=True)
-    issuer_id_fk = Column(String, ForeignKey("issuers.id", ondelete="CASCADE"))
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    issuer_id_fk = Column(UUID(as_uuid=True), ForeignKey("issuers.id", ondelete="CASCADE"))
     kid = Column(String, unique=True, index=True)  # Changed: Now globally unique
     alg = Column(String)
     public_key_pem = Column(Text)
     is_active = Column(Boolean, default=True)
     revoked = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
 
     issuer = relationship("Issuer", back_populates="keys")
 
@@ -106,40 +109,76 @@ class CredentialStatus(str, enum.Enum):
 
 class Credential(Base):
     __tablename__ = "credentials"
-    id = Column(String, primary_key=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     jti = Column(String, unique=True, index=True)
     format = Column(SAEnum(VCFormat, name="vc_format"))
     issuer_did = Column(String, index=True)
     holder_subject = Column(String, index=True)
     types = Column(JSONB, nullable=True)
-    issued_at = Column(DateTime, nullable=True)
-    not_before = Column(DateTime, nullable=True)
-    expires_at = Column(DateTime, nullable=True)
+    issued_at = Column(UTCDateTime, nullable=True)
+    not_before = Column(UTCDateTime, nullable=True)
+    expires_at = Column(UTCDateTime, nullable=True)
     status = Column(SAEnum(CredentialStatus, name="cred_status"), default=CredentialStatus.ACTIVE)
-    revoked_at = Column(DateTime, nullable=True)
+    revoked_at = Column(UTCDateTime, nullable=True)
     revoke_reason = Column(String, nullable=True)
 
     raw_encrypted = Column(Text, nullable=False)
     raw_sha256 = Column(String, index=True)
 
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
 
 class RevokedCredential(Base):
     __tablename__ = "revoked_credentials"
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     jti = Column(String, unique=True, index=True)
-    revoked_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    revoked_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
     reason = Column(String, nullable=True)
 
 # New table to log every scan event
 class Scan(Base):
     __tablename__ = "scans"
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     jti = Column(String, nullable=False)
     verified = Column(Boolean, nullable=False)
-    scanned_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    scanned_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc))
+
+# Partial indexes for the read paths that exist; every index adds write cost,
+# so add new ones alongside the queries that use them
+Index(
+    "ix_issuer_keys_active",
+    IssuerKey.issuer_id_fk,
+    postgresql_where=text("is_active AND NOT revoked"),
+)
+Index(
+    "ix_issuer_keys_revoked",
+    IssuerKey.kid,
+    postgresql_where=text("revoked"),
+)
 
-Base.metadata.create_all(bind=engine)
+# -----------------------
+# Prebuilt statements
+# -----------------------
+# Hot-path queries built once at import; the engine's compiled cache then keys
+# on the same construct instead of rebuilding the expression tree per request.
+# Plain boolean predicates (not IS TRUE/IS FALSE) so the planner matches ix_issuer_keys_active
+_ACTIVE_KEY_FILTER = (IssuerKey.is_active, ~IssuerKey.revoked)
+_TRUST_VERSION_STMT = select(func.count(), func.max(IssuerKey.created_at)).where(*_ACTIVE_KEY_FILTER)
+# Single join returning plain column tuples - no ORM objects, no per-key relationship loads
+_TRUST_STMT = (
+    select(Issuer.issuer_id, IssuerKey.kid, IssuerKey.alg, IssuerKey.public_key_pem)
+    .join(IssuerKey, IssuerKey.issuer_id_fk == Issuer.id)
+    .where(*_ACTIVE_KEY_FILTER)
+)
+_REVOCATIONS_VERSION_STMT = select(func.count(), func.max(RevokedCredential.revoked_at))
+# Postgres renders the jti array as JSON text, which is spliced into the
+# body as-is, so revoked rows never become Python objects on this side
+_REVOCATIONS_STMT = select(
+    cast(func.json_agg(aggregate_order_by(RevokedCredential.jti, RevokedCredential.revoked_at)), Text)
+)
+# A single array parameter, so the lookup is one round trip whatever the batch size
+_EXISTING_JTIS_STMT = select(Credential.jti).where(
+    Credential.jti == any_(bindparam("jtis", type_=ARRAY(String)))
+)
 
 # -----------------------
 # Schemas (Pydantic)
@@ -149,7 +188,7 @@ class HolderIn(BaseModel):
     display_name: Optional[str] = None
 
 class HolderOut(BaseModel):
-    id: str
+    id: uuid.UUID
     subject: str
     display_name: Optional[str]
     created_at: datetime
@@ -166,7 +205,7 @@ class IssuerKeyIn(BaseModel):
     is_active: bool = True
 
 class CredentialOut(BaseModel):
-    id: str
+    id: uuid.UUID
     jti: str
     format: VCFormat
     issuer_did: Optional[str]
@@ -194,7 +233,7 @@ class RevocationListOut(BaseModel):
     revokedJti: List[str]
 
 class ScanOut(BaseModel):
-    id: str
+    id: uuid.UUID
     jti: str
     verified: bool
     scanned_at: datetime
@@ -212,30 +251,31 @@ class CredentialBatch(BaseModel):
 # -----------------------
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Create default admin user
-    db = SessionLocal()
-    try:
-        # Check if admin user already exists
-        admin_user = db.query(User).filter(User.username == "admin").first()
-        if not admin_user:
-            # Get admin password from environment or use default
-            admin_password = os.getenv("ADMIN_PASSWORD")
-            hashed_password = get_password_hash(admin_password)
-            
-            admin_user = User(
-                username="admin",
-                hashed_password=hashed_password,
-                user_type="admin"
-            )
-            db.add(admin_user)
-            db.commit()
-            print("✅ Default admin user created: admin")
-        else:
-            print("ℹ️ Admin user already exists")
-    except Exception as e:
-        print(f"❌ Failed to create admin user: {e}")
-    finally:
-        db.close()
+    # Startup: create tables (auth and VC models share database.Base)
+    await create_tables()
+
+    # Create default admin user
+    async with SessionLocal() as db:
+        try:
+            # Check if admin user already exists
+            admin_user = await db.scalar(select(User.username).where(User.username == "admin"))
+            if not admin_user:
+                # Get admin password from environment or use default
+                admin_password = os.getenv("ADMIN_PASSWORD")
+                hashed_password = get_password_hash(admin_password)
+                
+                admin_user = User(
+                    username="admin",
+                    hashed_password=hashed_password,
+                    user_type="admin"
+                )
+                db.add(admin_user)
+                await db.commit()
+                print("✅ Default admin user created: admin")
+            else:
+                print("ℹ️ Admin user already exists")
+        except Exception as e:
+            print(f"❌ Failed to create admin user: {e}")
     
     yield
     
@@ -245,7 +285,8 @@ async def lifespan(app: FastAPI):
 app = FastAPI(
     title="VC Storage Backend (Postgres)", 
     version="0.2.0",
-    lifespan=lifespan  # Add this line
+    lifespan=lifespan,  # Add this line
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -258,12 +299,11 @@ app.add_middleware(
 
 app.include_router(auth_router)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    # Pool exhausted for DB_POOL_TIMEOUT seconds: shed load with a retryable status
+    logger.warning("Database pool exhausted: %s", exc)
+    return ORJSONResponse({"detail": "Service busy, retry shortly"}, status_code=503, headers={"Retry-After": "1"})
 
 # -----------------------
 # Utils
@@ -272,48 +312,121 @@ def now_utc() -> datetime:
     return datetime.now(timezone.utc)
 
 def enc(s: str) -> str:
-    return fernet.encrypt(s.encode()).decode()
+    nonce = os.urandom(12)
+    sealed = aesgcm.encrypt(nonce, s.encode(), None)
+    return AESGCM_PREFIX + base64.urlsafe_b64encode(nonce + sealed).decode()
 
 def dec(s: str) -> str:
+    if s.startswith(AESGCM_PREFIX):
+        raw = base64.urlsafe_b64decode(s[len(AESGCM_PREFIX):])
+        return aesgcm.decrypt(raw[:12], raw[12:], None).decode()
+    # Legacy Fernet blob
     return fernet.decrypt(s.encode()).decode()
 
 def sha256(s: str) -> str:
     return hashlib.sha256(s.encode()).hexdigest()
 
-def _parse_jws_unverified(token: str) -> Dict[str, Any]:
+# Pre-serialized bodies for the read-mostly verifier feeds (/trust-bundle, /revocations).
+# name -> (version, etag, body, checked_at); version is a cheap aggregate probe of the
+# source table, checked_at the monotonic time that version was last confirmed.
+_feed_cache: Dict[str, tuple] = {}
+
+def _feed_response(request: Request, etag: str, body: bytes) -> Response:
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+def fresh_feed(request: Request, name: str) -> Optional[Response]:
+    """Serve a feed confirmed within FEED_CACHE_TTL without touching the DB, else None."""
+    entry = _feed_cache.get(name)
+    if entry is None or time.monotonic() - entry[3] >= FEED_CACHE_TTL:
+        return None
+    return _feed_response(request, entry[1], entry[2])
+
+def cached_feed(request: Request, name: str, version: tuple) -> Optional[Response]:
+    """Serve a feed from cache if its version is unchanged, else None."""
+    entry = _feed_cache.get(name)
+    if entry is None or entry[0] != version:
+        return None
+    _feed_cache[name] = entry[:3] + (time.monotonic(),)
+    return _feed_response(request, entry[1], entry[2])
+
+def invalidate_feed(name: str) -> None:
+    # Writes in this worker show up immediately; other workers catch up within the TTL
+    _feed_cache.pop(name, None)
+
+def store_feed(request: Request, name: str, version: tuple, payload: Dict[str, Any]) -> Response:
+    """Serialize a freshly built feed once, cache it and serve it."""
+    etag = '"' + hashlib.blake2b(f"{name}:{version!r}".encode(), digest_size=16).hexdigest() + '"'
+    body = orjson.dumps(payload, option=orjson.OPT_UTC_Z)
+    _feed_cache[name] = (version, etag, body, time.monotonic())
+    return _feed_response(request, etag, body)
+
+def _epoch_to_dt(value: Any) -> Optional[datetime]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value, timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            # Out-of-range claim (e.g. milliseconds instead of seconds): leave the column empty
+            return None
+    return None
+
+def _credential_columns(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Map the JWS claims we index on to Credential column values."""
+    vc = payload.get("vc")
+    types = vc.get("type") if isinstance(vc, dict) else None
+    if isinstance(types, str):
+        types = [types]
+    return {
+        "issuer_did": payload.get("iss"),
+        "holder_subject": payload.get("sub"),
+        "types": types if isinstance(types, list) else None,
+        "issued_at": _epoch_to_dt(payload.get("iat")),
+        "not_before": _epoch_to_dt(payload.get("nbf")),
+        "expires_at": _epoch_to_dt(payload.get("exp")),
+    }
+
+# Parsed (unverified) JWS header/payload by the token's SHA-256 hex digest (the same
+# value stored as raw_sha256, so callers hash each JWS once) - replayed tokens skip the
+# base64 + JSON work. Nothing here is signature-checked, so there is nothing to expire
+# on `exp`; once verification is added, cache (payload, exp) and evict on exp instead.
+_jws_parse_cache = TTLCache(maxsize=10_000, ttl=60)
+_jws_parse_cache_lock = threading.Lock()
+
+def _parse_jws_unverified(token: str, digest: str) -> Dict[str, Any]:
+    """Cached wrapper around _decode_jws_unverified; callers must not mutate the result.
+
+    `digest` is sha256(token), computed once by the caller.
+    """
+    with _jws_parse_cache_lock:
+        parsed = _jws_parse_cache.get(digest)
+    if parsed is None:
+        parsed = _decode_jws_unverified(token)
+        with _jws_parse_cache_lock:
+            _jws_parse_cache[digest] = parsed
+    return parsed
+
+def _decode_jws_unverified(token: str) -> Dict[str, Any]:
     """Parse JWT/JWS header & payload WITHOUT verifying signature."""
     try:
-        import base64
-        import json
-        
         # Split the token into parts
         parts = token.split('.')
         if len(parts) != 3:
             raise ValueError("Invalid JWT format - expected 3 parts")
         
-        # Decode header
+        # Decode header; -len % 4 is exactly the padding needed (0-3 '=')
         header_b64 = parts[0]
-        # Add padding if needed
-        missing_padding = len(header_b64) % 4
-        if missing_padding:
-            header_b64 += '=' * (4 - missing_padding)
-        header_bytes = base64.urlsafe_b64decode(header_b64)
-        header = json.loads(header_bytes.decode('utf-8'))
+        # orjson parses the decoded bytes directly - no intermediate str
+        header = orjson.loads(base64.urlsafe_b64decode(header_b64 + '=' * (-len(header_b64) % 4)))
         
         # Decode payload
         payload_b64 = parts[1]
-        # Add padding if needed
-        missing_padding = len(payload_b64) % 4
-        if missing_padding:
-            payload_b64 += '=' * (4 - missing_padding)
-        payload_bytes = base64.urlsafe_b64decode(payload_b64)
-        payload = json.loads(payload_bytes.decode('utf-8'))
+        payload = orjson.loads(base64.urlsafe_b64decode(payload_b64 + '=' * (-len(payload_b64) % 4)))
         
         return {"header": header, "payload": payload}
         
     except Exception as e:
-        print(f"❌ JWT parse error: {e}")
-        print(f"❌ Token preview: {token[:50]}..." if len(token) > 50 else f"❌ Token: {token}")
+        logger.debug("JWS parse error: %s", e)
         raise ValueError(f"Invalid JWS: {e}")
 
 # -----------------------
@@ -321,142 +434,185 @@ def _parse_jws_unverified(token: str) -> Dict[str, Any]:
 # -----------------------
 # Holders
 @app.post("/holders", response_model=HolderOut)
-def create_holder(body: HolderIn, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    existing = db.query(Holder).filter_by(subject=body.subject).first()
-    if existing:
-        return HolderOut(
-            id=existing.id,
-            subject=existing.subject,
-            display_name=existing.display_name,
-            created_at=existing.created_at,
-        )
-    h = Holder(id=str(uuid.uuid4()), subject=body.subject, display_name=body.display_name)
-    db.add(h); db.commit(); db.refresh(h)
+async def create_holder(body: HolderIn, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    cols = (Holder.id, Holder.subject, Holder.display_name, Holder.created_at)
+    stmt = (
+        pg_insert(Holder)
+        .values(id=uuid.uuid4(), subject=body.subject, display_name=body.display_name)
+        .on_conflict_do_nothing(index_elements=[Holder.subject])
+        .returning(*cols)
+    )
+    h = (await db.execute(stmt)).first()
+    await db.commit()
+    if h is None:
+        # Already registered - a plain read; DO UPDATE would rewrite the row on every repeat
+        h = (await db.execute(select(*cols).where(Holder.subject == body.subject))).first()
     return HolderOut(id=h.id, subject=h.subject, display_name=h.display_name, created_at=h.created_at)
 
 # Issuers & keys
 @app.post("/issuers")
-def add_issuer(body: IssuerIn, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    ex = db.query(Issuer).filter_by(issuer_id=body.issuer_id).first()
-    if ex:
-        return {"id": ex.id, "issuer_id": ex.issuer_id, "name": ex.name}
-    iss = Issuer(id=str(uuid.uuid4()), issuer_id=body.issuer_id, name=body.name)
-    db.add(iss); db.commit(); db.refresh(iss)
+async def add_issuer(body: IssuerIn, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    cols = (Issuer.id, Issuer.issuer_id, Issuer.name)
+    stmt = (
+        pg_insert(Issuer)
+        .values(id=uuid.uuid4(), issuer_id=body.issuer_id, name=body.name)
+        .on_conflict_do_nothing(index_elements=[Issuer.issuer_id])
+        .returning(*cols)
+    )
+    iss = (await db.execute(stmt)).first()
+    await db.commit()
+    if iss is None:
+        # Already registered - return the existing issuer
+        iss = (await db.execute(select(*cols).where(Issuer.issuer_id == body.issuer_id))).first()
     return {"id": iss.id, "issuer_id": iss.issuer_id, "name": iss.name}
 
 @app.post("/issuers/keys")
-def add_issuer_key(body: IssuerKeyIn, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    iss = db.query(Issuer).filter_by(issuer_id=body.issuer_id).first()
-    if not iss:
-        raise HTTPException(404, detail="Issuer not found")
-    
-    # Check if kid already exists globally
-    existing_key = db.query(IssuerKey).filter_by(kid=body.kid).first()
-    if existing_key:
-        # Get the issuer info for better error message
-        existing_issuer = db.query(Issuer).filter_by(id=existing_key.issuer_id_fk).first()
+async def add_issuer_key(body: IssuerKeyIn, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # INSERT ... SELECT resolves the issuer and inserts in one statement; no row comes
+    # back if the issuer is unknown or the kid is taken (kid is globally unique)
+    source = select(
+        literal(uuid.uuid4(), UUID(as_uuid=True)),
+        Issuer.id,
+        literal(body.kid),
+        literal(body.alg),
+        literal(body.public_key_pem, Text),
+        literal(body.is_active),
+        literal(False),
+        literal(now_utc(), UTCDateTime),
+    ).where(Issuer.issuer_id == body.issuer_id)
+    key_id = await db.scalar(
+        pg_insert(IssuerKey)
+        .from_select(
+            ["id", "issuer_id_fk", "kid", "alg", "public_key_pem", "is_active", "revoked", "created_at"],
+            source,
+        )
+        .on_conflict_do_nothing(index_elements=[IssuerKey.kid])
+        .returning(IssuerKey.id)
+    )
+    if key_id is None:
+        # Failure path only: tell a missing issuer from a duplicate kid in one query
+        issuer_exists, existing_issuer_id = (await db.execute(select(
+            exists().where(Issuer.issuer_id == body.issuer_id),
+            select(Issuer.issuer_id)
+            .join(IssuerKey, IssuerKey.issuer_id_fk == Issuer.id)
+            .where(IssuerKey.kid == body.kid)
+            .scalar_subquery(),
+        ))).one()
+        if not issuer_exists:
+            raise HTTPException(404, detail="Issuer not found")
         raise HTTPException(
             409, 
-            detail=f"Key ID '{body.kid}' already exists for issuer '{existing_issuer.issuer_id}'. Key IDs must be globally unique."
+            detail=f"Key ID '{body.kid}' already exists for issuer '{existing_issuer_id}'. Key IDs must be globally unique."
         )
-    
-    k = IssuerKey(
-        id=str(uuid.uuid4()), 
-        issuer_id_fk=iss.id,
-        kid=body.kid, 
-        alg=body.alg, 
-        public_key_pem=body.public_key_pem, 
-        is_active=body.is_active
-    )
-    db.add(k)
-    db.commit()
-    db.refresh(k)
-    return {"ok": True, "id": k.id}
+
+    await db.commit()
+    invalidate_feed("trust-bundle")
+    return {"ok": True, "id": key_id}
 
 # Trust bundle (for offline verifiers to prefetch)
 @app.get("/trust-bundle", response_model=TrustBundleOut)
-def get_trust_bundle(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    # Query issuer_keys directly with a join to get issuer information
-    active_keys = db.query(IssuerKey, Issuer).join(
-        Issuer, IssuerKey.issuer_id_fk == Issuer.id
-    ).filter(
-        IssuerKey.is_active == True,
-        IssuerKey.revoked == False
-    ).all()
+async def get_trust_bundle(request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    fresh = fresh_feed(request, "trust-bundle")
+    if fresh is not None:
+        return fresh
+
+    version = tuple((await db.execute(_TRUST_VERSION_STMT)).one())
+    cached = cached_feed(request, "trust-bundle", version)
+    if cached is not None:
+        return cached
+
+    active_keys = (await db.execute(_TRUST_STMT)).all()
     
     # Build the trust bundle items
-    trust_bundle_items = []
-    for key, issuer in active_keys:
-        trust_bundle_items.append({
-            "issuerId": issuer.issuer_id,
-            "kid": key.kid,
-            "alg": key.alg,
-            "publicKeyPem": key.public_key_pem,
-        })
+    trust_bundle_items = [
+        {
+            "issuerId": issuer_id,
+            "kid": kid,
+            "alg": alg,
+            "publicKeyPem": public_key_pem,
+        }
+        for issuer_id, kid, alg, public_key_pem in active_keys
+    ]
+    logger.debug("Trust bundle rebuilt with %d active keys", len(trust_bundle_items))
     
-    print(f"Found {len(trust_bundle_items)} active keys")
-    for item in trust_bundle_items:
-        print(f"  - Issuer: {item['issuerId']}, Kid: {item['kid']}")
-    
-    return TrustBundleOut(
-        version=len(trust_bundle_items),
-        issuedAt=now_utc(),
-        issuers=trust_bundle_items
-    )
+    return store_feed(request, "trust-bundle", version, {
+        "version": len(trust_bundle_items),
+        "issuedAt": now_utc(),
+        "issuers": trust_bundle_items,
+    })
 
 # Revocation list for offline verifiers
 @app.get("/revocations", response_model=RevocationListOut)
-def revocations(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    revoked_entries = db.query(RevokedCredential.jti).all()
-    out = [r[0] for r in revoked_entries]
-    version = len(out)
-    return RevocationListOut(version=version, issuedAt=now_utc(), revokedJti=out)
+async def revocations(request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    fresh = fresh_feed(request, "revocations")
+    if fresh is not None:
+        return fresh
+
+    version = tuple((await db.execute(_REVOCATIONS_VERSION_STMT)).one())
+    cached = cached_feed(request, "revocations", version)
+    if cached is not None:
+        return cached
+
+    out = await db.scalar(_REVOCATIONS_STMT) or "[]"
+    return store_feed(request, "revocations", version, {
+        "version": version[0],
+        "issuedAt": now_utc(),
+        "revokedJti": orjson.Fragment(out),
+    })
 
 @app.post("/credentials/{jti}/revoke")
-def revoke_credential(jti: str, body: RevokeIn, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    cred = db.query(Credential).filter_by(jti=jti).first()
-    if not cred:
+async def revoke_credential(jti: str, body: RevokeIn, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # Both presence checks as EXISTS in one round trip
+    cred_exists, already = (await db.execute(select(
+        exists().where(Credential.jti == jti),
+        exists().where(RevokedCredential.jti == jti),
+    ))).one()
+    if not cred_exists:
         raise HTTPException(404, detail="Credential not found")
-    
-    revoked_entry = db.query(RevokedCredential).filter_by(jti=jti).first()
-    if revoked_entry:
+    if already:
         return {"ok": True, "already": True}
 
-    cred.status = CredentialStatus.REVOKED
-    cred.revoked_at = now_utc()
-    cred.revoke_reason = body.reason
-    db.add(cred)
+    await db.execute(
+        update(Credential)
+        .where(Credential.jti == jti)
+        .values(status=CredentialStatus.REVOKED, revoked_at=now_utc(), revoke_reason=body.reason)
+    )
 
     revoked_cred = RevokedCredential(jti=jti, reason=body.reason)
     db.add(revoked_cred)
     
-    db.commit()
+    await db.commit()
+    invalidate_feed("revocations")
     return {"ok": True}
 
 # Add a new endpoint to revoke issuer keys
 @app.post("/issuers/keys/{kid}/revoke")
-def revoke_issuer_key(
+async def revoke_issuer_key(
     kid: str, 
     reason: Optional[str] = None, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)  # Add authentication
 ):
-    key = db.query(IssuerKey).filter(IssuerKey.kid == kid).first()
-    if not key:
-        raise HTTPException(status_code=404, detail="Issuer key not found")
-
-    if key.revoked:
+    # Flip the flag in place; only when nothing matched do we look at why
+    revoked_id = await db.scalar(
+        update(IssuerKey)
+        .where(IssuerKey.kid == kid, IssuerKey.revoked.is_not(True))
+        .values(revoked=True)
+        .returning(IssuerKey.id)
+    )
+    if revoked_id is None:
+        if not await db.scalar(select(exists().where(IssuerKey.kid == kid))):
+            raise HTTPException(status_code=404, detail="Issuer key not found")
         return {"message": "Issuer key is already revoked", "kid": kid, "already": True}
 
-    key.revoked = True
-    db.commit()
+    await db.commit()
+    invalidate_feed("trust-bundle")
     return {"message": "Issuer key revoked successfully", "kid": kid, "reason": reason}
 
 @app.get("/issuers/keys/revoked")
-def get_revoked_issuer_keys(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_revoked_issuer_keys(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     """Get a list of all revoked issuer key IDs (kids)"""
-    revoked_keys = db.query(IssuerKey.kid).filter(IssuerKey.revoked == True).all()
-    revoked_kids = [key[0] for key in revoked_keys]  # Extract the kid values
+    revoked_kids = (await db.scalars(select(IssuerKey.kid).where(IssuerKey.revoked))).all()
     
     return {
         "revokedKids": revoked_kids,
@@ -465,82 +621,123 @@ def get_revoked_issuer_keys(db: Session = Depends(get_db), current_user: User =
 
 # Batch upload scans
 @app.post("/scans/batch")
-def upload_scan_batch(
+async def upload_scan_batch(
     body: ScanBatch, 
-    db: Session = Depends(get_db), 
+    db: AsyncSession = Depends(get_db), 
     current_user: User = Depends(get_current_user)
 ):
     """Upload a batch of scan events from offline queue"""
-    uploaded = 0
+    rows = []
     for scan_data in body.scans:
         try:
-            scan_event = Scan(
-                jti=scan_data.get("jti", "unknown"),
-                verified=scan_data.get("verified", False)
-            )
-            # Parse scanned_at if provided
+            scanned_at = now_utc()
+            # Parse scanned_at if provided (3.11+ fromisoformat is C-backed and accepts a trailing 'Z')
             if "scanned_at" in scan_data:
-                scan_event.scanned_at = datetime.fromisoformat(scan_data["scanned_at"].replace('Z', '+00:00'))
+                scanned_at = datetime.fromisoformat(scan_data["scanned_at"])
             
-            db.add(scan_event)
-            uploaded += 1
+            # asyncpg binds strictly (no implicit int -> varchar cast), so normalize
+            # here where a bad row is skipped instead of failing the whole batch
+            jti = scan_data.get("jti")
+            jti = "unknown" if jti is None else str(jti)
+            verified = scan_data.get("verified", False)
+            if not isinstance(verified, bool):
+                raise ValueError(f"verified must be a boolean, got {verified!r}")
+
+            rows.append({
+                "id": uuid.uuid4(),  # pre-generated, so no column default fires per row
+                "jti": jti,
+                "verified": verified,
+                "scanned_at": scanned_at,
+            })
         except Exception as e:
-            print(f"Failed to upload scan: {e}")
+            logger.warning("Skipping invalid scan in batch: %s", e)
     
     try:
-        db.commit()
-        return {"uploaded": uploaded, "total": len(body.scans)}
+        if rows:
+            # Single executemany INSERT (batched into multi-VALUES) instead of a flush per object
+            await db.execute(insert(Scan), rows)
+        await db.commit()
+        return {"uploaded": len(rows), "total": len(body.scans)}
+    except PoolTimeoutError:
+        raise  # let the 503 + Retry-After handler answer, not a 400
     except Exception as e:
-        db.rollback()
-        print(e)
+        await db.rollback()
+        logger.warning("Scan batch upload failed: %s", e)
         raise HTTPException(400, detail=f"Batch upload failed: {e}")
 
 # Batch upload credentials
 @app.post("/credentials/batch")
-def upload_credential_batch(
+async def upload_credential_batch(
     body: CredentialBatch, 
-    db: Session = Depends(get_db), 
+    db: AsyncSession = Depends(get_db), 
     current_user: User = Depends(get_current_user)
 ):
     """Upload a batch of credentials from offline queue"""
-    uploaded = 0
+    parsed: Dict[str, tuple] = {}
     for cred_data in body.credentials:
         try:
             jws = cred_data.get("jws", "")
             if not jws:
                 continue
                 
+            # Hash once: the digest is the parse-cache key, the stored fingerprint and the
+            # stable fallback id for credentials without a jti, so replays of those dedupe too
+            digest = sha256(jws)
+
             # Parse and store credential (reuse existing logic)
-            meta = _parse_jws_unverified(jws)
+            meta = _parse_jws_unverified(jws, digest)
             payload = meta["payload"]
+            # asyncpg binds strictly, so a non-string claim would otherwise fail the whole
+            # batch at execute time; reject the credential here instead
+            bad = [c for c in ("jti", "iss", "sub") if not isinstance(payload.get(c), (str, type(None)))]
+            if bad:
+                raise ValueError(f"non-string claim(s): {', '.join(bad)}")
             
-            jti = payload.get("jti") or str(uuid.uuid4())
-            
-            # Check if already exists
-            existing = db.query(Credential).filter_by(jti=jti).first()
-            if existing:
-                continue  # Skip duplicates
-                
-            # Create credential (simplified version)
-            cred = Credential(
-                id=str(uuid.uuid4()),
-                jti=jti,
-                format=VCFormat.jws,
-                issuer_did=payload.get("iss"),
-                holder_subject=payload.get("sub"),
-                raw_encrypted=enc(jws),
-                raw_sha256=sha256(jws),
-                status=CredentialStatus.ACTIVE,
-            )
-            db.add(cred)
-            uploaded += 1
+            jti = payload.get("jti") or digest
+            if jti in parsed:
+                continue  # Skip duplicates within the batch
+            # Column mapping stays per credential, so anything it rejects skips only this one
+            parsed[jti] = (jws, digest, _credential_columns(payload))
             
         except Exception as e:
-            print(f"Failed to upload credential: {e}")
+            logger.warning("Skipping invalid credential in batch: %s", e)
     
     try:
-        db.commit()
+        # Find already-stored credentials up front, so replayed uploads skip encryption entirely
+        existing = set()
+        if parsed:
+            existing = set(await db.scalars(_EXISTING_JTIS_STMT, {"jtis": list(parsed)}))
+
+        # Create credential rows (simplified version)
+        values = [
+            {
+                "id": uuid.uuid4(),
+                "jti": jti,
+                "format": VCFormat.jws,
+                **columns,
+                "raw_encrypted": enc(jws),
+                "raw_sha256": digest,
+                "status": CredentialStatus.ACTIVE,
+            }
+            for jti, (jws, digest, columns) in parsed.items()
+            if jti not in existing
+        ]
+
+        uploaded = 0
+        for i in range(0, len(values), BATCH_INSERT_CHUNK):
+            # One multi-row INSERT; ON CONFLICT still covers rows stored concurrently
+            stmt = (
+                pg_insert(Credential)
+                .values(values[i:i + BATCH_INSERT_CHUNK])
+                .on_conflict_do_nothing(index_elements=[Credential.jti])
+                .returning(Credential.id)
+            )
+            uploaded += len((await db.execute(stmt)).all())
+        await db.commit()
         return {"uploaded": uploaded, "total": len(body.credentials)}
+    except PoolTimeoutError:
+        raise  # let the 503 + Retry-After handler answer, not a 400
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        logger.warning("Credential batch upload failed: %s", e)
         raise HTTPException(400, detail=f"Batch upload failed: {e}")
\ No newline at end of file